@@ -118,6 +118,9 @@ module.exports = NodeHelper.create({
                     const message = JSON.parse(data);
                     if (message.type === "waveform") {
                         this.sendSocketNotification("WAVEFORM_DATA", message.data);
+                    } else if (message.type === "waveform_batch" && message.samples.length > 0) {
+                        // Frames merged under backpressure: only the latest matters for display
+                        this.sendSocketNotification("WAVEFORM_DATA", message.samples[message.samples.length - 1]);
                     }
                 } catch (error) {
                     console.error("Error parsing WebSocket message:", error);
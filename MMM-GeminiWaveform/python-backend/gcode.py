@@ -97,7 +97,7 @@ pya = pyaudio.PyAudio()
 
 
 class AudioLoop:
-    def __init__(self, video_mode=DEFAULT_MODE, camera_index=0):
+    def __init__(self, video_mode=DEFAULT_MODE, camera_index=0, show_waveform=True):
         self.video_mode = video_mode
         self.camera_index = camera_index
 
@@ -115,8 +115,8 @@ class AudioLoop:
         # itself). Implemented as an asyncio.Event for safe cross-task use.
         self.is_playing = asyncio.Event()
         
-        # Initialize the waveform UI
-        self.waveform_ui = WaveformUI(width=800, height=150)
+        # Initialize the waveform UI (None when running without a local window)
+        self.waveform_ui = WaveformUI(width=800, height=150) if show_waveform else None
 
     async def send_text(self):
         while True:
@@ -292,7 +292,8 @@ class AudioLoop:
         while True:
             bytestream = await self.audio_in_queue.get()
             # Update the waveform UI with the audio data
-            self.waveform_ui.update_audio(bytestream)
+            if self.waveform_ui:
+                self.waveform_ui.update_audio(bytestream)
             await asyncio.to_thread(stream.write, bytestream)
 
     async def run(self):
@@ -317,19 +318,21 @@ class AudioLoop:
                 tg.create_task(self.receive_audio())
                 tg.create_task(self.play_audio())
                 # Run the waveform UI on the main thread event loop
-                tg.create_task(self.waveform_ui.run())
+                if self.waveform_ui:
+                    tg.create_task(self.waveform_ui.run())
 
                 await send_text_task
                 raise asyncio.CancelledError("User requested exit")
 
         except asyncio.CancelledError:
             # Clean up the waveform UI
-            self.waveform_ui.close()
-            pass
+            if self.waveform_ui:
+                self.waveform_ui.close()
         except ExceptionGroup as EG:
             self.audio_stream.close()
             # Clean up the waveform UI
-            self.waveform_ui.close()
+            if self.waveform_ui:
+                self.waveform_ui.close()
             traceback.print_exception(EG)
 
 
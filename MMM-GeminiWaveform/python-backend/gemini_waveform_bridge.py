@@ -8,60 +8,145 @@ import asyncio
 import json
 import logging
 import os
-import signal
+import queue
 import sys
+import threading
 from pathlib import Path
 
 import websockets
 import numpy as np
 import pyaudio
 
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (and unavailable on Windows)
+    uvloop = None
+
 # Import from current directory (no path manipulation needed)
 from gcode import AudioLoop, client, MODEL, CONFIG, FORMAT, CHANNELS, RECEIVE_SAMPLE_RATE
-from waveform_server import WaveformServer
+from waveform_server import SHUTDOWN, WaveformServer, install_shutdown_handlers
 
 logger = logging.getLogger(__name__)
 
+# Number of audio chunks the playback thread may hold beyond the one it is writing
+PLAYBACK_AHEAD_CHUNKS = 2
+
 
 class GeminiWaveformBridge(AudioLoop):
     """Extended AudioLoop that streams waveform data via WebSocket."""
     
     def __init__(self, waveform_server, *args, **kwargs):
+        # Force headless UI by default so no local window opens when running the
+        # bridge. Can be overridden with GEMINI_HEADLESS=0.
+        kwargs.setdefault("show_waveform", os.environ.get("GEMINI_HEADLESS", "1") != "1")
         super().__init__(*args, **kwargs)
         self.waveform_server = waveform_server
+        # Bound once so the playback loop makes a single call per chunk
+        self._update_audio = waveform_server.get_waveform_updater()
         self.pya = pyaudio.PyAudio()  # Initialize PyAudio instance
+
+        # Output stream and writer thread, created on first playback
+        self._stream = None
+        self._pending_playback = None
+        self._playback_thread = None
+        self._write_slots = None
+        self._playback_failed = None
         
-        # Force headless UI by default so no local window opens when running the
-        # bridge. Can be overridden with GEMINI_HEADLESS=0.
-        if os.environ.get("GEMINI_HEADLESS", "1") == "1":
-            class _HeadlessUI:
-                def __init__(self):
-                    self.is_running = True
-                async def run(self):
-                    while self.is_running:
-                        await asyncio.sleep(3600)
-                def close(self):
-                    self.is_running = False
-            self.waveform_ui = _HeadlessUI()
-        
-    async def play_audio(self):
-        """Override play_audio to capture and stream waveform data."""
-        stream = await asyncio.to_thread(
+    async def _open_playback(self):
+        """Open the output stream and start its writer thread, once."""
+        if self._stream is not None:
+            return
+        self._stream = await asyncio.to_thread(
             self.pya.open,
             format=FORMAT,
             channels=CHANNELS,
             rate=RECEIVE_SAMPLE_RATE,
             output=True,
         )
+
+        # Blocking PortAudio writes happen on a dedicated thread instead of a
+        # thread-pool hop per chunk. The semaphore bounds how far playback can
+        # run ahead, so draining audio_in_queue on interruption still stops
+        # speech promptly. A write error is reported through _playback_failed.
+        loop = asyncio.get_running_loop()
+        self._pending_playback = queue.SimpleQueue()
+        self._write_slots = asyncio.Semaphore(PLAYBACK_AHEAD_CHUNKS)
+        self._playback_failed = loop.create_future()
+        self._playback_thread = threading.Thread(
+            target=self._playback_writer,
+            args=(self._stream, self._pending_playback, loop, self._write_slots, self._playback_failed),
+            name="gemini-playback",
+            daemon=True,
+        )
+        self._playback_thread.start()
+
+    async def _close_playback(self):
+        """Stop the writer thread and close the output stream, if open."""
+        if self._stream is None:
+            return
+        self._pending_playback.put(None)
+        await asyncio.to_thread(self._playback_thread.join)
+        if self._playback_failed.done():
+            # Retrieve the writer's error so it is logged even if play_audio()
+            # was cancelled before it could raise it
+            logger.warning(f"Playback stopped after write error: {self._playback_failed.exception()}")
+        try:
+            await asyncio.to_thread(self._stream.stop_stream)
+            self._stream.close()
+        except OSError as e:
+            logger.warning(f"Error closing playback stream: {e}")
+        self._stream = None
+
+    async def play_audio(self):
+        """Override play_audio to capture and stream waveform data."""
+        # The stream is reused if the audio loop is restarted after a reconnect
+        await self._open_playback()
+
         while True:
             bytestream = await self.audio_in_queue.get()
-            
-            # Update waveform with audio data
-            if self.waveform_server.waveform_ui:
-                self.waveform_server.waveform_ui.update_audio(bytestream)
-            
+
+            # Wait for room in the playback thread, then surface any write
+            # error it hit so the audio loop fails as a direct write would
+            await self._write_slots.acquire()
+            if self._playback_failed.done():
+                error = self._playback_failed.exception()
+                await self._close_playback()
+                raise error
+
+            # Update waveform with audio data, in step with what is played
+            self._update_audio(bytestream)
+
             # Play audio
-            await asyncio.to_thread(stream.write, bytestream)
+            self._pending_playback.put(bytestream)
+
+    async def close(self):
+        """Stop the playback thread and release PortAudio resources."""
+        await self._close_playback()
+        self.pya.terminate()
+
+    @staticmethod
+    def _playback_writer(stream, pending, loop, write_slots, failed):
+        """Write queued PCM chunks to the output stream until given None.
+
+        A write error ends the thread and is set on `failed` for play_audio().
+        """
+        def notify(callback, *args):
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                pass  # Event loop already closed during shutdown
+
+        while True:
+            chunk = pending.get()
+            if chunk is None:
+                break
+            try:
+                stream.write(chunk)
+            except Exception as e:
+                notify(failed.set_exception, e)
+                break
+            finally:
+                notify(write_slots.release)
 
 
 async def run_gemini_with_waveform():
@@ -82,47 +167,45 @@ async def run_gemini_with_waveform():
         camera_index=camera_index
     )
     
+    # Top-level service tasks; shutdown only needs to cancel these
+    tasks = []
+
     # Start both services in parallel
     try:
         # Create tasks for both services
-        server_task = asyncio.create_task(waveform_server.start())
+        tasks.append(asyncio.create_task(waveform_server.start()))
         
         # Give server time to start
         await asyncio.sleep(1)
         
         # Start Gemini audio loop
-        gemini_task = asyncio.create_task(audio_loop.run())
+        tasks.append(asyncio.create_task(audio_loop.run()))
         
         # Wait for both tasks (they should run forever)
-        await asyncio.gather(server_task, gemini_task)
+        await asyncio.gather(*tasks)
     except asyncio.CancelledError:
         logger.info("Services stopped")
         # Cancel both tasks on shutdown
-        server_task.cancel()
-        gemini_task.cancel()
-        await asyncio.gather(server_task, gemini_task, return_exceptions=True)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await audio_loop.close()
 
 
 async def main():
     """Main entry point with signal handling."""
-    loop = asyncio.get_running_loop()
-    
-    # Shutdown handler
-    shutdown_event = asyncio.Event()
-    
-    def handle_shutdown():
-        logger.info("Shutdown signal received")
-        shutdown_event.set()
-        for task in asyncio.all_tasks(loop):
-            if task != asyncio.current_task():
-                task.cancel()
-    
-    # Register signal handlers
-    for sig in (signal.SIGTERM, signal.SIGINT):
-        loop.add_signal_handler(sig, handle_shutdown)
-    
+    install_shutdown_handlers(asyncio.get_running_loop())
+
+    services_task = asyncio.create_task(run_gemini_with_waveform())
+    shutdown_task = asyncio.create_task(SHUTDOWN.wait())
+    await asyncio.wait({services_task, shutdown_task}, return_when=asyncio.FIRST_COMPLETED)
+
+    # run_gemini_with_waveform() cancels its own service tasks in turn
+    shutdown_task.cancel()
+    services_task.cancel()
     try:
-        await run_gemini_with_waveform()
+        await services_task
     except asyncio.CancelledError:
         logger.info("Main task cancelled")
     except Exception as e:
@@ -138,7 +221,9 @@ if __name__ == "__main__":
     )
     
     try:
-        asyncio.run(main())
+        # Prefer the libuv-based event loop when it is installed
+        run = uvloop.run if uvloop else asyncio.run
+        run(main())
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
     except Exception as e:
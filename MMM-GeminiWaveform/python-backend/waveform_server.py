@@ -7,15 +7,34 @@ This bridges the Python Gemini API code with the JavaScript frontend.
 import asyncio
 import json
 import logging
+import math
 import signal
 import sys
 import time
+from collections import deque
 from pathlib import Path
 
 import websockets
 from websockets.server import WebSocketServerProtocol
 import numpy as np
 
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (and unavailable on Windows)
+    uvloop = None
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    def _dumps(message: dict) -> bytes:
+        return json.dumps(message).encode()
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy path is used instead
+    njit = None
+
 # Add parent directory to path to import existing modules
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
@@ -29,6 +48,69 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Bound once; read on every waveform tick
+_mono = time.monotonic_ns
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _abs_sum(pcm):
+        """Sum of absolute int16 sample values, in one pass over the buffer."""
+        total = 0
+        for i in range(len(pcm)):
+            sample = np.int64(pcm[i])
+            total += sample if sample >= 0 else -sample
+        return total
+
+    def _mean_abs_level(chunks):
+        """Mean absolute level of int16 PCM chunks, normalised to 0..1.
+
+        Each chunk is read in place through an int16 memoryview, so no
+        arrays are created. Returns -1.0 if the chunks hold no samples.
+        """
+        total = 0
+        count = 0
+        for chunk in chunks:
+            view = memoryview(chunk)
+            # Ignore a stray odd byte rather than failing the cast
+            pcm = view[:len(view) & ~1].cast("h")
+            total += _abs_sum(pcm)
+            count += len(pcm)
+        if not count:
+            return -1.0
+        return total / (count * 32768.0)
+else:
+    def _mean_abs_level(chunks):
+        """Mean absolute level of int16 PCM chunks, normalised to 0..1.
+
+        The chunks are joined once so NumPy runs over a single array per tick.
+        Returns -1.0 if the chunks hold no samples.
+        """
+        data = b"".join(chunks)
+        pcm = np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+        if not pcm.size:
+            return -1.0
+        # Widening to int32 inside abs() avoids the int16 overflow at -32768
+        total = int(np.abs(pcm, dtype=np.int32).sum(dtype=np.int64))
+        return total / (pcm.size * 32768.0)
+
+
+def _update_amplitude(level, current, target, alpha, idle, idle_amp, idle_decay):
+    """Advance the smoothed amplitude by one tick.
+
+    Takes the new mean absolute `level` (negative when no audio arrived),
+    eases `current` towards `target` by `alpha`, and while idle keeps a
+    breathing floor of `idle_amp` and decays `target`.
+    Returns the new (current, target) pair.
+    """
+    if level >= 0.0:
+        target = level
+    current += (target - current) * alpha
+    if idle:
+        current = max(current, idle_amp)
+        target *= idle_decay
+    return current, target
+
 
 class WaveformServer:
     """WebSocket server that streams waveform data from the Gemini audio."""
@@ -40,6 +122,34 @@ class WaveformServer:
         self.waveform_ui = None
         self.audio_loop = None
         self.update_interval = 0.016  # 60fps by default
+        self.wave_speed = 0.35  # Phase advance per 16ms frame
+        # Adaptive broadcasting while audio plays: only send when amplitude
+        # moved noticeably, otherwise fall back to a heartbeat. The heartbeat
+        # must stay below the frontend's 250ms idle threshold, or it decays the
+        # wave between frames. Once idle, the frontend draws its own breathing
+        # wave, so nothing is sent after the first idle frame
+        self.amplitude_epsilon = 0.005
+        self.heartbeat_interval = 0.2
+        # Each client gets a small outbound queue drained by its own relay
+        # task, so one slow client cannot hold up the others
+        self.client_queue_size = 4
+        # While a client's socket has more than this many bytes unsent, its
+        # relay holds frames back and merges up to max_batch_size of them
+        self.write_buffer_threshold = 1024
+        self.max_batch_size = 4
+        self._outboxes = {}
+        self._relays = {}
+        # Frame counter sent instead of a timestamp; clients time on receipt
+        self._seq = 0
+        # Initial state is the same for every connection, so encode it once
+        self._initial_payload = _dumps({
+            "type": "waveform",
+            "data": {
+                "amplitude": 0.0,
+                "phase": 0.0,
+                "connected": True
+            }
+        }).decode()
         
     async def register(self, websocket: WebSocketServerProtocol) -> None:
         """Register a new client connection."""
@@ -47,35 +157,86 @@ class WaveformServer:
         logger.info(f"Client connected. Total clients: {len(self.clients)}")
         
         # Send initial state
-        await self.send_to_client(websocket, {
-            "type": "waveform",
-            "data": {
-                "amplitude": 0.0,
-                "phase": 0.0,
-                "connected": True
-            }
-        })
+        try:
+            await websocket.send(self._initial_payload)
+        except websockets.exceptions.ConnectionClosed:
+            await self.unregister(websocket)
+        except Exception as e:
+            logger.error(f"Error sending to client: {e}")
+
+        if websocket in self.clients:
+            outbox = asyncio.Queue(maxsize=self.client_queue_size)
+            self._outboxes[websocket] = outbox
+            self._relays[websocket] = asyncio.create_task(self._relay(websocket, outbox))
         
     async def unregister(self, websocket: WebSocketServerProtocol) -> None:
         """Unregister a client connection."""
         self.clients.discard(websocket)
+        self._outboxes.pop(websocket, None)
+        relay = self._relays.pop(websocket, None)
+        if relay is not None and relay is not asyncio.current_task():
+            relay.cancel()
         logger.info(f"Client disconnected. Total clients: {len(self.clients)}")
         
     async def send_to_client(self, websocket: WebSocketServerProtocol, message: dict) -> None:
         """Send a message to a specific client."""
         try:
-            await websocket.send(json.dumps(message))
+            await websocket.send(_dumps(message).decode())
         except websockets.exceptions.ConnectionClosed:
             await self.unregister(websocket)
         except Exception as e:
             logger.error(f"Error sending to client: {e}")
             
+    async def _relay(self, websocket: WebSocketServerProtocol, outbox: asyncio.Queue) -> None:
+        """Forward queued frames to a single client.
+
+        While the client's socket is backlogged, waveform frames are held back
+        and merged into one waveform_batch message for this client only.
+        """
+        while True:
+            pending = [await outbox.get()]
+            # Hold frames back while this client's socket is still flushing
+            # earlier data; the heartbeat timeout stops a lone frame stalling
+            while len(pending) < self.max_batch_size and self._backlogged(websocket):
+                try:
+                    pending.append(await asyncio.wait_for(outbox.get(), self.heartbeat_interval))
+                except asyncio.TimeoutError:
+                    break
+            while not outbox.empty():
+                pending.append(outbox.get_nowait())
+
+            if len(pending) == 1:
+                payloads = [pending[0][0]]
+            else:
+                payloads = [p for p, m in pending if m.get("type") != "waveform"]
+                samples = [m["data"] for _, m in pending if m.get("type") == "waveform"]
+                if samples:
+                    payloads.append(_dumps({"type": "waveform_batch", "samples": samples}).decode())
+            try:
+                for frame in payloads:
+                    await websocket.send(frame)
+            except websockets.exceptions.ConnectionClosed:
+                await self.unregister(websocket)
+                return
+            except Exception as e:
+                logger.error(f"Error sending to client: {e}")
+
+    def _backlogged(self, websocket: WebSocketServerProtocol) -> bool:
+        """Return True if this client's socket has a noticeable amount of unsent data."""
+        transport = getattr(websocket, "transport", None)
+        return transport is not None and transport.get_write_buffer_size() > self.write_buffer_threshold
+
     async def broadcast(self, message: dict) -> None:
         """Broadcast a message to all connected clients."""
-        if self.clients:
-            # Create tasks for all sends
-            tasks = [self.send_to_client(client, message) for client in self.clients.copy()]
-            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._outboxes:
+            # Serialize once and share the encoded frame between all clients.
+            # Decoded to str so clients keep receiving text frames.
+            payload = _dumps(message).decode()
+            for outbox in self._outboxes.values():
+                if outbox.full():
+                    # Drop the oldest frame so slow clients still get the latest one
+                    outbox.get_nowait()
+                outbox.put_nowait((payload, message))
             
     async def handle_client(self, websocket: WebSocketServerProtocol) -> None:
         """Handle a client connection.
@@ -117,69 +278,127 @@ class WaveformServer:
         
         # Initialize waveform UI in headless mode
         class HeadlessWaveformUI:
-            """A headless version that just tracks waveform data without rendering."""
-            def __init__(self):
+            """A headless version that just tracks waveform data without rendering.
+
+            State is evaluated on demand via advance() rather than by a separate
+            60Hz task, so phase does not drift with event-loop scheduling jitter.
+            """
+            # Reference step the original per-frame constants were tuned for
+            frame_time = 0.016
+            idle_after_ns = 250_000_000
+            # Time constant equivalent to easing 18% towards target per frame
+            smoothing_tau = -frame_time / math.log(1.0 - 0.18)
+
+            def __init__(self, wave_speed):
                 self.current_amplitude = 0.0
                 self.target_amplitude = 0.0
                 self.wave_phase = 0.0
-                self.wave_speed = 0.35
+                self.wave_speed = wave_speed
                 self.idle_amplitude = 0.06
-                self._last_audio_time = 0.0
-                self.is_running = True
-                
+                # Timestamps are integer nanoseconds from time.monotonic_ns()
+                self._last_audio_ns = 0
+                self._t0_ns = _mono()
+                self._last_advance_ns = self._t0_ns
+                # Raw PCM chunks from the playback task, drained once per tick.
+                # deque appends/pops are atomic, so no extra locking is needed.
+                self._pending_audio = deque(maxlen=64)
+
             def update_audio(self, audio_data):
-                """Update amplitude from audio data."""
+                """Queue audio data; its amplitude is measured on the next advance()."""
                 if audio_data:
-                    self._last_audio_time = time.time()
-                    # Calculate amplitude from audio data
-                    amp = np.abs(np.frombuffer(audio_data, dtype=np.int16)).mean() / 32768.0
-                    self.target_amplitude = amp
-                    
-            async def run(self):
-                """Headless run loop - just updates values."""
-                while self.is_running:
-                    # Smooth amplitude
-                    self.current_amplitude += (self.target_amplitude - self.current_amplitude) * 0.18
-                    
-                    # Check for idle state
-                    idle_dt = time.time() - self._last_audio_time
-                    if idle_dt > 0.25:
-                        # Apply idle amplitude
-                        idle_amp = self.idle_amplitude * (0.6 + 0.4 * np.sin(self.wave_phase * 0.6))
-                        self.current_amplitude = max(self.current_amplitude, idle_amp)
-                        self.target_amplitude *= 0.96
-                        
-                    # Update phase
-                    self.wave_phase += self.wave_speed
-                    
-                    await asyncio.sleep(0.016)
-                    
-            def close(self):
-                self.is_running = False
-        
-        self.waveform_ui = HeadlessWaveformUI()
-        
-        # Start the headless waveform update
-        waveform_task = asyncio.create_task(self.waveform_ui.run())
-        
+                    self._last_audio_ns = _mono()
+                    self._pending_audio.append(audio_data)
+
+            def _measure_pending_audio(self):
+                """Return the mean absolute level of PCM received since the last tick.
+
+                Returns -1.0 if nothing arrived.
+                """
+                if not self._pending_audio:
+                    return -1.0
+                chunks = []
+                while self._pending_audio:
+                    chunks.append(self._pending_audio.popleft())
+                return _mean_abs_level(chunks)
+
+            def is_idle(self, now_ns):
+                """Return True when no audio has arrived for a short while."""
+                return now_ns - self._last_audio_ns > self.idle_after_ns
+
+            def advance(self, now_ns):
+                """Bring amplitude and phase up to date for monotonic time `now_ns`."""
+                dt = (now_ns - self._last_advance_ns) * 1e-9
+                self._last_advance_ns = now_ns
+
+                # Closed-form phase and frame-rate independent smoothing
+                elapsed = (now_ns - self._t0_ns) * 1e-9
+                self.wave_phase = self.wave_speed * elapsed / self.frame_time
+                alpha = 1.0 - math.exp(-dt / self.smoothing_tau)
+
+                # Idle breathing floor and target decay, applied by
+                # _update_amplitude() only when no audio has arrived recently
+                idle_amp = self.idle_amplitude * (0.6 + 0.4 * math.sin(self.wave_phase * 0.6))
+                idle_decay = 0.96 ** (dt / self.frame_time)
+
+                self.current_amplitude, self.target_amplitude = _update_amplitude(
+                    self._measure_pending_audio(),
+                    self.current_amplitude,
+                    self.target_amplitude,
+                    alpha,
+                    self.is_idle(now_ns),
+                    idle_amp,
+                    idle_decay,
+                )
+
+        self.waveform_ui = HeadlessWaveformUI(wave_speed=self.wave_speed)
+        last_sent_amplitude = None
+        last_sent_ns = 0
+        idle_frame_sent = False
+
         try:
             while True:
-                # Broadcast current waveform state
-                await self.broadcast({
-                    "type": "waveform",
-                    "data": {
-                        "amplitude": self.waveform_ui.current_amplitude,
-                        "phase": self.waveform_ui.wave_phase,
-                        "timestamp": time.time()
-                    }
-                })
+                now_ns = _mono()
+                self.waveform_ui.advance(now_ns)
+
+                if not self._outboxes:
+                    # Nobody is listening: skip building and encoding frames
+                    await asyncio.sleep(self.update_interval)
+                    continue
+
+                amplitude = float(self.waveform_ui.current_amplitude)
+
+                idle = self.waveform_ui.is_idle(now_ns)
+                if idle:
+                    send = not idle_frame_sent
+                else:
+                    # Skip frames whose amplitude barely changed since the last one
+                    heartbeat_due = now_ns - last_sent_ns >= self.heartbeat_interval * 1e9
+                    changed = (
+                        last_sent_amplitude is None
+                        or abs(amplitude - last_sent_amplitude) > self.amplitude_epsilon
+                    )
+                    send = heartbeat_due or changed
+                    idle_frame_sent = False
+
+                if send:
+                    # Broadcast current waveform state
+                    await self.broadcast({
+                        "type": "waveform",
+                        "data": {
+                            "amplitude": amplitude,
+                            "phase": float(self.waveform_ui.wave_phase),
+                            "seq": self._seq
+                        }
+                    })
+                    last_sent_amplitude = amplitude
+                    last_sent_ns = now_ns
+                    self._seq += 1
+                    idle_frame_sent = idle
                 
                 await asyncio.sleep(self.update_interval)
                 
         except asyncio.CancelledError:
             logger.info("Waveform update loop cancelled")
-            self.waveform_ui.close()
-            await waveform_task
             raise
             
     def get_waveform_updater(self):
@@ -193,11 +412,27 @@ class WaveformServer:
         """Start the WebSocket server."""
         logger.info(f"Starting WebSocket server on {self.host}:{self.port}")
         
+        if njit is not None:
+            # Compile the PCM kernel off the event loop; compiling lazily on the
+            # first audio tick would stall playback and websocket I/O
+            await asyncio.to_thread(_abs_sum, memoryview(b"\0\0").cast("h"))
+
         # Start the waveform update loop
         update_task = asyncio.create_task(self.waveform_update_loop())
         
-        # Start WebSocket server
-        async with websockets.serve(self.handle_client, self.host, self.port):
+        # Start WebSocket server. Payloads are tiny JSON frames, so
+        # permessage-deflate costs more CPU than it saves. max_queue and
+        # write_limit also bound per-connection memory for slow clients.
+        async with websockets.serve(
+            self.handle_client,
+            self.host,
+            self.port,
+            compression=None,
+            ping_interval=20,
+            ping_timeout=10,
+            max_queue=8,
+            write_limit=2 ** 16,
+        ):
             logger.info(f"WebSocket server listening on ws://{self.host}:{self.port}")
             try:
                 await asyncio.Future()  # Run forever
@@ -207,24 +442,35 @@ class WaveformServer:
                 await update_task
 
 
-async def main():
-    """Main entry point."""
-    server = WaveformServer()
-    
-    # Handle shutdown gracefully
-    loop = asyncio.get_running_loop()
-    
+# Shared by every entry point in this process; set by the signal handlers
+SHUTDOWN = asyncio.Event()
+
+
+def install_shutdown_handlers(loop: asyncio.AbstractEventLoop) -> None:
+    """Set SHUTDOWN when SIGTERM or SIGINT is received."""
     def handle_shutdown():
         logger.info("Shutdown signal received")
-        for task in asyncio.all_tasks(loop):
-            task.cancel()
-    
-    # Register signal handlers
+        SHUTDOWN.set()
+
     for sig in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(sig, handle_shutdown)
+
+
+async def main():
+    """Main entry point."""
+    server = WaveformServer()
     
+    # Handle shutdown gracefully
+    install_shutdown_handlers(asyncio.get_running_loop())
+
+    server_task = asyncio.create_task(server.start())
+    shutdown_task = asyncio.create_task(SHUTDOWN.wait())
+    await asyncio.wait({server_task, shutdown_task}, return_when=asyncio.FIRST_COMPLETED)
+
+    shutdown_task.cancel()
+    server_task.cancel()
     try:
-        await server.start()
+        await server_task
     except asyncio.CancelledError:
         logger.info("Server stopped")
     except Exception as e:
@@ -235,7 +481,9 @@ async def main():
 if __name__ == "__main__":
     try:
         import numpy  # Check if numpy is available
-        asyncio.run(main())
+        # Prefer the libuv-based event loop when it is installed
+        run = uvloop.run if uvloop else asyncio.run
+        run(main())
     except ImportError:
         logger.error("NumPy is required. Please install it: pip install numpy")
         sys.exit(1)